@@ -1,11 +1,27 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-import requests
-import base64
+from flask_caching import Cache
+import asyncio
+import httpx
+try:
+    import pybase64 as base64  # SIMD加速的base64实现，接口与标准库兼容
+except ImportError:
+    import base64
+import io
+import hashlib
 import os
+import re
+import random
+import threading
+import time
 import logging
-import json  # 添加这行
-from zhipuai import ZhipuAI
+try:
+    import orjson as json  # loads接口兼容标准库，解析上游响应快2-5倍
+except ImportError:
+    import json
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+from cachetools import TTLCache
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -13,8 +29,17 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app)
 
+# 限制上传大小，超大请求在解析阶段直接拒绝，不会整块读进内存
+app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024
+
+# 响应缓存：相同的foodName+weight组合直接返回缓存结果
+cache = Cache(app, config={
+    'CACHE_TYPE': 'SimpleCache',
+    'CACHE_DEFAULT_TIMEOUT': 86400
+})
+
 # 配置日志
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'))
 logger = logging.getLogger(__name__)
 
 # 百度AI配置
@@ -26,81 +51,230 @@ BAIDU_DISH_DETECT_URL = "https://aip.baidubce.com/rest/2.0/image-classify/v2/dis
 BAIDU_INGREDIENT_DETECT_URL = "https://aip.baidubce.com/rest/2.0/image-classify/v1/classify/ingredient"
 BAIDU_GENERAL_DETECT_URL = "https://aip.baidubce.com/rest/2.0/image-classify/v2/advanced_general"
 
-def identify_with_baidu(image_base64, access_token):
-    """使用百度多个识别接口进行识别"""
+# httpx连接池配置：一个请求内的令牌获取和多次识别调用共用一个连接池
+# 连接阶段单独收紧超时：上游不可达时快速失败并触发重试，而不是吃满30秒
+HTTP_TIMEOUT = httpx.Timeout(30.0, connect=5.0)
+HTTP_LIMITS = httpx.Limits(max_connections=500, max_keepalive_connections=200, keepalive_expiry=60)
+
+def make_http_client():
+    """创建带连接池配置的httpx客户端，启用HTTP/2多路复用"""
+    return httpx.AsyncClient(http2=True, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+
+# 重试配置：只对限流(429)、服务端错误(5xx)和网络错误重试，其他4xx立即失败
+RETRY_MAX_TRIES = 3
+RETRY_BASE_DELAY = 0.5
+
+# 上游并发上限：突发流量时排队而不是把百度/智谱的限流打爆
+# 每个请求跑在自己的工作线程上，用线程信号量在进程内做全局限制。
+# 上限从GUNICORN_THREADS推导（Procfile用同一个变量起线程池），
+# 取线程数的一半，保证信号量严格小于线程数、真正能挡住请求
+GUNICORN_THREADS = int(os.getenv('GUNICORN_THREADS', '8'))
+MAX_UPSTREAM_CONCURRENCY = max(1, GUNICORN_THREADS // 2)
+_upstream_semaphore = threading.BoundedSemaphore(MAX_UPSTREAM_CONCURRENCY)
+
+async def post_with_retry(http_client, url, **kwargs):
+    """带指数退避和随机抖动的POST重试"""
+    last_error = None
+    for attempt in range(RETRY_MAX_TRIES):
+        if attempt > 0:
+            # full jitter：在0到指数上限之间随机取值，避免重试风暴
+            delay = random.uniform(0, RETRY_BASE_DELAY * (2 ** attempt))
+            logger.warning("第%d次重试 %s, 等待%.2f秒", attempt, url, delay)
+            await asyncio.sleep(delay)
+        try:
+            response = await http_client.post(url, **kwargs)
+            if response.status_code != 429 and response.status_code < 500:
+                return response
+            last_error = httpx.HTTPStatusError(
+                f"上游返回{response.status_code}", request=response.request, response=response
+            )
+        except httpx.TransportError as e:
+            last_error = e
+    raise last_error
+
+# 食物相关关键词：单字关键词用集合交集做哈希探测，多字词合并成一个正则
+SINGLE_CHAR_FOOD_KEYWORDS = frozenset('瓜果菜肉鱼虾蛋奶')
+MULTI_CHAR_FOOD_KEYWORDS = (
+    '食物', '水果', '蔬菜', '零食', '饮料', '甜点', '面包',
+    '糕点', '坚果', '干果', '食材', '主食', '小吃', '糖果'
+)
+FOOD_KEYWORD_RE = re.compile('|'.join(map(re.escape, MULTI_CHAR_FOOD_KEYWORDS)))
+
+def is_food_related(text):
+    """判断文本是否和食物相关：先做单字集合交集，未命中再扫多字关键词"""
+    return bool(SINGLE_CHAR_FOOD_KEYWORDS.intersection(text)) or bool(FOOD_KEYWORD_RE.search(text))
+
+# 从LLM响应里提取数字用的正则，预编译避免每次解析重新编译
+NUMBER_RE = re.compile(r'\d+')
+
+# 模型偶尔把JSON包在```代码块```或说明文字里，用正则抠出对象本体再解析
+JSON_OBJECT_RE = re.compile(r'\{[^{}]*\}')
+
+def parse_llm_json(response_text):
+    """从LLM响应中提取并解析JSON对象，失败返回None"""
+    match = JSON_OBJECT_RE.search(response_text)
+    if not match:
+        return None
+    try:
+        return json.loads(match.group())
+    except json.JSONDecodeError:
+        return None
+
+def to_int(value):
+    """LLM返回的数字可能是int、数字字符串或带引号的字符串，统一转成int"""
+    if isinstance(value, int):
+        return value
+    match = NUMBER_RE.search(str(value))
+    if not match:
+        raise ValueError(f"无法解析数字: {value!r}")
+    return int(match.group())
+
+# 估算失败时的默认值：拍平成单个有序字典，一次遍历代替五组any()扫描
+# 顺序保持原优先级：主食 > 肉类 > 蔬菜 > 水果 > 浆果
+DEFAULT_FOOD_INFO = {
+    '饭': (250, 350), '面': (250, 350), '粥': (250, 350),
+    '肉': (180, 280), '鱼': (180, 280), '鸡': (180, 280), '鸭': (180, 280),
+    '菜': (120, 50), '青菜': (120, 50), '生菜': (120, 50),
+    '苹果': (180, 80), '梨': (180, 80), '橙子': (180, 80), '柚子': (180, 80),
+    '草莓': (100, 45), '葡萄': (100, 45), '樱桃': (100, 45),
+}
+DEFAULT_FOOD_INFO_FALLBACK = (200, 200)
+
+def get_default_food_info(food_name):
+    """按关键词查默认重量和热量，命中第一个即返回"""
+    return next(
+        (info for kw, info in DEFAULT_FOOD_INFO.items() if kw in food_name),
+        DEFAULT_FOOD_INFO_FALLBACK
+    )
+
+# 图片压缩配置：识别接口不需要原始分辨率，压缩后上传更快
+MAX_IMAGE_SIZE = 1024
+JPEG_QUALITY = 85
+
+def image_ahash(image):
+    """计算8x8平均哈希：近似重复的图片得到相同的64位指纹"""
+    gray = image.convert('L').resize((8, 8))
+    pixels = list(gray.getdata())
+    avg = sum(pixels) / 64
+    bits = 0
+    for px in pixels:
+        bits = (bits << 1) | (px > avg)
+    return bits
+
+def compress_image(stream):
+    """解码并压缩图片：限制最长边、重新编码为JPEG，减小上传体积
+
+    在进程池子进程里运行：上传内容先整块读成bytes序列化过来，
+    这里拿到的是包着这些bytes的BytesIO，整块读取是跨进程必须的。
+    返回 (压缩后的字节, 感知哈希)；解码失败时返回原始字节和None。
+    """
+    try:
+        image = Image.open(stream)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        ahash = image_ahash(image)
+        image.thumbnail((MAX_IMAGE_SIZE, MAX_IMAGE_SIZE))
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+        compressed = buffer.getvalue()
+        logger.info("图片压缩后大小: %d 字节", len(compressed))
+        return compressed, ahash
+    except Exception as e:
+        logger.warning("图片压缩失败，使用原图: %s", e)
+        stream.seek(0)
+        return stream.read(), None
+
+def _compress_image_task(raw_bytes):
+    """进程池工作函数：在子进程里完成解码和压缩，入参出参都是可序列化的字节"""
+    return compress_image(io.BytesIO(raw_bytes))
+
+# 图片解码和缩放是纯CPU工作且不释放GIL，放进进程池执行，
+# 避免压缩大图时卡住gunicorn工作线程里的其他请求
+_image_pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 2)
+
+def _consume_task_error(task):
+    """取走被取消/落选任务的异常，避免事件循环打印未消费告警"""
+    if not task.cancelled():
+        task.exception()
+
+async def identify_with_baidu(http_client, image_base64, access_token):
+    """并发调用百度三个识别接口，按菜品>食材>通用的优先级取结果"""
     logger.info("开始食物识别流程")
-    
+
     params = {
         'image': image_base64,
         'access_token': access_token
     }
-    
-    # 1. 首先尝试菜品识别
+
+    # 三个接口并发发出；按优先级依次检查，高优先级命中后立即取消其余请求，
+    # 让后续的重量估算尽早开始，而不是干等最慢的接口返回
+    dish_task = asyncio.create_task(post_with_retry(http_client, BAIDU_DISH_DETECT_URL, data=params))
+    ingredient_task = asyncio.create_task(post_with_retry(http_client, BAIDU_INGREDIENT_DETECT_URL, data=params))
+    general_task = asyncio.create_task(post_with_retry(http_client, BAIDU_GENERAL_DETECT_URL, data=params))
+    all_tasks = (dish_task, ingredient_task, general_task)
+    for task in all_tasks:
+        task.add_done_callback(_consume_task_error)
+
+    def cancel_pending():
+        for task in all_tasks:
+            task.cancel()
+
+    # 1. 菜品识别优先
     try:
-        response = requests.post(BAIDU_DISH_DETECT_URL, data=params)
-        result = response.json()
-        logger.info(f"菜品识别结果: {result}")
-        
+        result = json.loads((await dish_task).content)
+        logger.debug("菜品识别结果: %s", result)
+
         if 'result' in result and len(result['result']) > 0:
             food_info = result['result'][0]
             if food_info['name'] != '非菜':
+                cancel_pending()
                 return {
                     'name': food_info['name'],
                     'confidence': food_info['probability'],
                     'is_food': True
                 }
     except Exception as e:
-        logger.error(f"菜品识别出错: {str(e)}")
-    
-    # 2. 如果不是菜品，尝试食材识别
+        logger.error("菜品识别出错: %s", e)
+
+    # 2. 如果不是菜品，看食材识别结果
     try:
-        logger.info("尝试食材识别")
-        response = requests.post(BAIDU_INGREDIENT_DETECT_URL, data=params)
-        result = response.json()
-        logger.info(f"食材识别结果: {result}")
-        
+        result = json.loads((await ingredient_task).content)
+        logger.debug("食材识别结果: %s", result)
+
         if 'result' in result and len(result['result']) > 0:
             food_info = result['result'][0]
             if food_info['name'] != '非果蔬食材':
+                cancel_pending()
                 return {
                     'name': food_info['name'],
                     'confidence': food_info['score'],
                     'is_food': True
                 }
     except Exception as e:
-        logger.error(f"食材识别出错: {str(e)}")
-    
-    # 3. 最后尝试通用物体识别
+        logger.error("食材识别出错: %s", e)
+
+    # 3. 最后看通用物体识别结果
     try:
-        logger.info("尝试通用物体识别")
-        response = requests.post(BAIDU_GENERAL_DETECT_URL, data=params)
-        result = response.json()
-        logger.info(f"通用识别结果: {result}")
-        
+        result = json.loads((await general_task).content)
+        logger.debug("通用识别结果: %s", result)
+
         if 'result' in result and len(result['result']) > 0:
-            # 过滤出可能是食物的结果
-            food_keywords = [
-                '食物', '水果', '蔬菜', '零食', '饮料', '甜点', '面包', 
-                '糕点', '坚果', '干果', '食材', '主食', '小吃', '糖果',
-                '瓜', '果', '菜', '肉', '鱼', '虾', '蛋', '奶'
-            ]
-            
             first_result = result['result'][0]
             keyword = first_result['keyword']
             root = first_result.get('root', '')
-            
+
             # 检查是否是食物相关
-            is_food = any(kw in keyword or kw in root for kw in food_keywords)
-            
+            is_food = is_food_related(keyword) or is_food_related(root)
+
             return {
                 'name': keyword,
                 'confidence': first_result['score'],
                 'is_food': is_food
             }
-            
+
     except Exception as e:
-        logger.error(f"通用识别出错: {str(e)}")
-    
+        logger.error("通用识别出错: %s", e)
+
     raise ValueError("无法识别物体")
 
 # 智谱AI配置
@@ -108,31 +282,20 @@ ZHIPU_API_KEY = os.getenv('ZHIPU_API_KEY')
 if not ZHIPU_API_KEY:
     raise ValueError("未找到ZHIPU_API_KEY环境变量")
 
-logger.info(f"ZHIPU_API_KEY: {ZHIPU_API_KEY[:10]}...")
-client = ZhipuAI(api_key=ZHIPU_API_KEY)
+# 直接调用智谱的REST接口，绕过同步SDK
+ZHIPU_CHAT_URL = "https://open.bigmodel.cn/api/paas/v4/chat/completions"
+ZHIPU_HEADERS = {"Authorization": f"Bearer {ZHIPU_API_KEY}"}
+# flash档更快更便宜，输出只是一个小JSON，限制max_tokens避免模型发散
+ZHIPU_MODEL = "glm-4v-flash"
+ZHIPU_MAX_TOKENS = 64
+# data URL前缀按bytes拼接：一次bytes相加比f-string格式化少拷贝一遍base64大块
+DATA_URL_PREFIX = b"data:image/jpeg;base64,"
 
-def get_baidu_access_token():
-    """获取百度AI访问令牌"""
-    params = {
-        'grant_type': 'client_credentials',
-        'client_id': BAIDU_API_KEY,
-        'client_secret': BAIDU_SECRET_KEY
-    }
-    response = requests.post(BAIDU_TOKEN_URL, params=params)
-    return response.json().get('access_token')
+# 系统提示词在模块级构建一次，每次请求只需要拼装用户消息
+ZHIPU_ESTIMATE_SYSTEM = {
+    "role": "system",
+    "content": """你是一个食物营养专家。请根据图片估算食物的重量和热量。
 
-def estimate_food_info_from_image(image_base64, food_name):
-    """使用智谱AI同时估算食物的重量和热量"""
-    try:
-        logger.info(f"开始估算食物信息: {food_name}")
-        
-        response = client.chat.completions.create(
-            model="glm-4v",
-            messages=[
-                {
-                    "role": "system",
-                    "content": """你是一个食物营养专家。请根据图片估算食物的重量和热量。
-                    
 你必须严格按照以下JSON格式返回，确保weight和calories字段只包含纯数字：
 {
     "weight": 250,
@@ -150,7 +313,98 @@ def estimate_food_info_from_image(image_base64, food_name):
 2. 不要使用"约"字
 3. 不要添加任何额外说明
 4. 严格按照JSON格式返回"""
-                },
+}
+
+ZHIPU_IDENTIFY_SYSTEM = {
+    "role": "system",
+    "content": """你是一个食物营养专家。请识别图片中的物体，如果是食物则估算其重量和热量。
+
+你必须严格按照以下JSON格式返回，name为中文名称，weight和calories字段只包含纯数字：
+{
+    "name": "米饭",
+    "weight": 250,
+    "calories": 350
+}
+
+注意：
+1. 如果图片中不是食物，weight和calories返回0
+2. 必须返回纯数字，不要带引号
+3. 不要添加任何额外说明"""
+}
+
+# 百度token有效期约30天，进程内缓存，提前5分钟刷新
+_token_cache = {'token': None, 'exp': 0}
+_token_lock = threading.Lock()
+TOKEN_REFRESH_BUFFER = 300
+
+async def get_baidu_access_token(http_client):
+    """获取百度AI访问令牌（带TTL缓存，临近过期才重新请求）"""
+    with _token_lock:
+        if _token_cache['token'] and time.time() < _token_cache['exp'] - TOKEN_REFRESH_BUFFER:
+            return _token_cache['token']
+
+    params = {
+        'grant_type': 'client_credentials',
+        'client_id': BAIDU_API_KEY,
+        'client_secret': BAIDU_SECRET_KEY
+    }
+    response = await post_with_retry(http_client, BAIDU_TOKEN_URL, params=params)
+    data = json.loads(response.content)
+    token = data.get('access_token')
+    if token:
+        with _token_lock:
+            _token_cache['token'] = token
+            _token_cache['exp'] = time.time() + data.get('expires_in', 2592000)
+    return token
+
+async def zhipu_chat_stream(http_client, payload):
+    """流式调用智谱聊天接口，收到完整JSON对象即断开连接
+
+    答案只是一个短JSON对象，但模型常在后面附加解释文字；
+    看到闭合花括号就停止接收，省掉生成尾巴的等待时间。
+    """
+    payload = dict(payload, stream=True)
+    pieces = []
+    async with http_client.stream('POST', ZHIPU_CHAT_URL, json=payload, headers=ZHIPU_HEADERS) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.startswith('data:'):
+                continue
+            data = line[5:].strip()
+            if data == '[DONE]':
+                break
+            delta = json.loads(data)['choices'][0]['delta'].get('content') or ''
+            pieces.append(delta)
+            if '}' in delta:
+                break
+    return ''.join(pieces).strip()
+
+# 估算结果缓存：按(感知哈希, 食物名)复用，近似重复的图片跳过LLM调用
+_estimate_cache = TTLCache(maxsize=4096, ttl=86400)
+_estimate_lock = threading.Lock()
+
+# 重复上传缓存：同一张图片（按内容哈希）直接返回上次的完整识别结果
+_image_result_cache = TTLCache(maxsize=10000, ttl=7 * 86400)
+_image_result_lock = threading.Lock()
+
+async def estimate_food_info_from_image(http_client, image_data_url, food_name, image_hash=None):
+    """使用智谱AI同时估算食物的重量和热量"""
+    cache_key = (image_hash, food_name)
+    if image_hash is not None:
+        with _estimate_lock:
+            cached = _estimate_cache.get(cache_key)
+        if cached:
+            logger.info("估算缓存命中: %s", food_name)
+            return cached
+
+    try:
+        logger.info("开始估算食物信息: %s", food_name)
+
+        payload = {
+            "model": ZHIPU_MODEL,
+            "max_tokens": ZHIPU_MAX_TOKENS,
+            "messages": [
+                ZHIPU_ESTIMATE_SYSTEM,
                 {
                     "role": "user",
                     "content": [
@@ -161,33 +415,26 @@ def estimate_food_info_from_image(image_base64, food_name):
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
+                                "url": image_data_url
                             }
                         }
                     ]
                 }
             ]
-        )
-        
-        response_text = response.choices[0].message.content.strip()
-        logger.info(f"AI原始响应: {response_text}")
+        }
+
+        response_text = await zhipu_chat_stream(http_client, payload)
+        logger.debug("AI原始响应: %s", response_text)
         
         try:
             # 检查响应文本是否为空
             if not response_text:
                 raise ValueError("AI返回空响应")
             
-            # 尝试清理响应文本中的特殊字符
-            response_text = response_text.replace('\n', '').replace('\r', '').strip()
-            logger.info(f"清理后的响应: {response_text}")
-            
-            # 如果响应包含带引号的数字，先进行预处理
-            try:
-                result = json.loads(response_text)
-            except json.JSONDecodeError:
-                # 如果解析失败，尝试提取数字
-                import re
-                numbers = re.findall(r'\d+', response_text)
+            # 先抠出JSON对象解析；失败时直接退回数字提取
+            result = parse_llm_json(response_text)
+            if result is None:
+                numbers = NUMBER_RE.findall(response_text)
                 if len(numbers) >= 2:
                     result = {
                         "weight": numbers[0],
@@ -197,113 +444,228 @@ def estimate_food_info_from_image(image_base64, food_name):
                     raise ValueError("无法提取数字")
             
             # 确保转换为整数
-            weight = int(str(result['weight']).replace('"', ''))
-            calories = int(str(result['calories']).replace('"', ''))
+            weight = to_int(result['weight'])
+            calories = to_int(result['calories'])
             
             # 合理性检查
             if not (50 <= weight <= 1000) or not (20 <= calories <= 1000):
                 raise ValueError(f"数值超出合理范围 - 重量: {weight}, 热量: {calories}")
                 
-            logger.info(f"成功解析 - 重量: {weight}, 热量: {calories}")
-            return {
+            logger.info("成功解析 - 重量: %d, 热量: %d", weight, calories)
+            food_info = {
                 'weight': weight,
                 'calories': calories
             }
-                
+            # 只缓存成功解析的结果，默认值不缓存，下次仍有机会拿到真实估算
+            if image_hash is not None:
+                with _estimate_lock:
+                    _estimate_cache[cache_key] = food_info
+            return food_info
+
         except (json.JSONDecodeError, ValueError, KeyError) as e:
-            logger.warning(f"JSON处理错误: {str(e)}")
+            logger.warning("JSON处理错误: %s", e)
             # 使用默认值
-            if any(keyword in food_name for keyword in ['饭', '面', '粥']):
-                weight, calories = 250, 350
-            elif any(keyword in food_name for keyword in ['肉', '鱼', '鸡', '鸭']):
-                weight, calories = 180, 280
-            elif any(keyword in food_name for keyword in ['菜', '青菜', '生菜']):
-                weight, calories = 120, 50
-            elif any(keyword in food_name for keyword in ['苹果', '梨', '橙子', '柚子']):
-                weight, calories = 180, 80
-            elif any(keyword in food_name for keyword in ['草莓', '葡萄', '樱桃']):
-                weight, calories = 100, 45
-            else:
-                weight, calories = 200, 200
-            
-            logger.info(f"使用默认值 - 重量: {weight}克, 热量: {calories}卡路里")
+            weight, calories = get_default_food_info(food_name)
+
+            logger.info("使用默认值 - 重量: %d克, 热量: %d卡路里", weight, calories)
             return {
                 'weight': weight,
                 'calories': calories
             }
         
     except Exception as e:
-        logger.error(f"食物信息估算错误: {str(e)}")
-        logger.error(f"错误详情: ", exc_info=True)
+        logger.error("食物信息估算错误: %s", e)
+        logger.error("错误详情: ", exc_info=True)
         return {
             'weight': 200,
             'calories': 200
         }
 
-food_info_cache = {}
+async def identify_and_estimate_with_zhipu(http_client, image_data_url):
+    """百度识别失败时的兜底：用GLM-4V一次调用同时完成识别和重量热量估算"""
+    logger.info("百度识别失败，尝试GLM-4V融合识别")
+
+    payload = {
+        "model": ZHIPU_MODEL,
+        "max_tokens": ZHIPU_MAX_TOKENS,
+        "messages": [
+            ZHIPU_IDENTIFY_SYSTEM,
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": "请识别这张图片并返回名称、重量和热量估算值。"
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": image_data_url
+                        }
+                    }
+                ]
+            }
+        ]
+    }
+
+    try:
+        response_text = await zhipu_chat_stream(http_client, payload)
+        logger.debug("GLM-4V融合识别响应: %s", response_text)
+
+        result = parse_llm_json(response_text)
+        if result is None:
+            raise ValueError("融合识别响应不是有效JSON")
+        weight = to_int(result['weight'])
+        calories = to_int(result['calories'])
+        is_food = weight > 0 and calories > 0
+
+        identified = {
+            'name': str(result['name']),
+            'confidence': 0.5,
+            'is_food': is_food
+        }
+        if is_food:
+            identified['weight'] = weight
+            identified['calories'] = calories
+        return identified
+    except Exception as e:
+        logger.error("GLM-4V融合识别出错: %s", e)
+        raise ValueError("无法识别物体")
+
+# 供/calories查询的识别结果缓存：限定容量和TTL，长驻进程不会无限增长
+food_info_cache = TTLCache(maxsize=4096, ttl=86400)
+_food_info_lock = threading.Lock()
+
+# 常见食物每100克热量参考表（卡路里），命中时无需任何上游调用
+FOOD_CALORIES_PER_100G = {
+    '米饭': 116, '面条': 110, '馒头': 223, '粥': 46, '面包': 313,
+    '饺子': 218, '包子': 227, '炒饭': 181,
+    '苹果': 52, '香蕉': 93, '橙子': 48, '梨': 51, '葡萄': 45,
+    '西瓜': 26, '草莓': 32, '桃子': 42, '樱桃': 46,
+    '猪肉': 395, '牛肉': 125, '鸡肉': 167, '鸭肉': 240,
+    '鱼': 113, '虾': 93, '鸡蛋': 144, '豆腐': 81,
+    '青菜': 15, '白菜': 20, '西红柿': 19, '黄瓜': 15, '土豆': 77,
+    '牛奶': 54, '酸奶': 72, '豆浆': 31
+}
+
+def compute_calories(food_name, weight):
+    """按识别缓存或本地参考表计算卡路里，都没有时返回None"""
+    with _food_info_lock:
+        food_info = food_info_cache.get(food_name)
+    if food_info:
+        # 写入时预存的每克热量直接相乘，老条目退回现算
+        cal_per_g = food_info.get('cal_per_g') or food_info['calories'] / food_info['weight']
+        adjusted_calories = int(weight * cal_per_g)
+        logger.info("计算结果: %d卡路里 (基于原始数据: %s卡路里/%s克)", adjusted_calories, food_info['calories'], food_info['weight'])
+        return adjusted_calories
+
+    per_100g = FOOD_CALORIES_PER_100G.get(food_name)
+    if per_100g:
+        adjusted_calories = int(per_100g * weight / 100)
+        logger.info("本地参考表命中: %s = %d卡路里/100克, 计算结果: %d卡路里", food_name, per_100g, adjusted_calories)
+        return adjusted_calories
+
+    return None
 
 @app.route('/identify', methods=['POST'])
-def identify_food():
+async def identify_food():
     logger.info("收到识别请求")
-    
+
     if 'food_image' not in request.files:
         logger.error("没有文件")
         return jsonify({'error': '没有文件'}), 400
-    
+
     file = request.files['food_image']
     if file.filename == '':
         logger.error("文件名为空")
         return jsonify({'error': '没有选择文件'}), 400
-    
+
     try:
-        # 读取图片并转换为base64
-        image_content = file.read()
-        image_base64 = base64.b64encode(image_content).decode('UTF-8')
-        
-        # 获取访问令牌
-        access_token = get_baidu_access_token()
-        
-        # 使用多重识别方法
-        result = identify_with_baidu(image_base64, access_token)
-        
-        food_name = result['name']
-        confidence = result['confidence']
-        is_food = result['is_food']
-        
-        logger.info(f"识别成功: 名称={food_name}, 置信度={confidence}, 是否食物={is_food}")
-        
-        response_data = {
-            'name': food_name,
-            'confidence': confidence,
-        }
-        
-        if is_food:
-            # 如果是食物，同时估算重量和热量
-            food_info = estimate_food_info_from_image(image_base64, food_name)
-            response_data.update({
-                'weight': food_info['weight'],
-                'calories': food_info['calories']
-            })
-            # 将食物信息存入缓存
-            food_info_cache[food_name] = food_info
-        else:
-            # 如果不是食物，添加提示信息
-            response_data['message'] = "这个不能吃哦"
-        
+        # 在进程池里压缩图片：只把原始字节和压缩结果跨进程传输，解码后的像素留在子进程
+        image_content, image_hash = await asyncio.get_running_loop().run_in_executor(
+            _image_pool, _compress_image_task, file.stream.read()
+        )
+
+        # 同一张图片重复上传时直接命中缓存，跳过百度和智谱调用
+        image_key = hashlib.blake2b(image_content, digest_size=16).hexdigest()
+        with _image_result_lock:
+            cached_response = _image_result_cache.get(image_key)
+        if cached_response:
+            logger.info("图片缓存命中: %s", image_key)
+            return jsonify(cached_response)
+
+        # base64输出必然是纯ASCII，按ascii解码比UTF-8少一次全量扫描
+        image_b64_bytes = base64.b64encode(image_content)
+        image_base64 = image_b64_bytes.decode('ascii')
+        # data URL在请求内只构建一次，两个智谱调用点直接复用
+        image_data_url = (DATA_URL_PREFIX + image_b64_bytes).decode('ascii')
+
+        # 限制同时访问上游的请求数，超出的在这里排队而不是打爆上游限流
+        with _upstream_semaphore:
+            async with make_http_client() as http_client:
+                # 获取访问令牌
+                access_token = await get_baidu_access_token(http_client)
+
+                # 使用多重识别方法
+                try:
+                    result = await identify_with_baidu(http_client, image_base64, access_token)
+                except ValueError:
+                    # 百度全部失败时，用GLM-4V一次调用同时完成识别和估算
+                    result = await identify_and_estimate_with_zhipu(http_client, image_data_url)
+
+                food_name = result['name']
+                confidence = result['confidence']
+                is_food = result['is_food']
+
+                logger.info("识别成功: 名称=%s, 置信度=%s, 是否食物=%s", food_name, confidence, is_food)
+
+                response_data = {
+                    'name': food_name,
+                    'confidence': confidence,
+                }
+
+                if is_food:
+                    if 'weight' in result:
+                        # 融合识别已经拿到了重量和热量，不再单独调用估算
+                        food_info = {'weight': result['weight'], 'calories': result['calories']}
+                    else:
+                        # 如果是食物，同时估算重量和热量
+                        food_info = await estimate_food_info_from_image(http_client, image_data_url, food_name, image_hash)
+                    response_data.update({
+                        'weight': food_info['weight'],
+                        'calories': food_info['calories']
+                    })
+                    # 将食物信息存入缓存，预先算好每克热量供/calories直接使用
+                    cache_entry = dict(food_info)
+                    cache_entry['cal_per_g'] = food_info['calories'] / food_info['weight']
+                    with _food_info_lock:
+                        food_info_cache[food_name] = cache_entry
+                else:
+                    # 如果不是食物，添加提示信息
+                    response_data['message'] = "这个不能吃哦"
+
+        with _image_result_lock:
+            _image_result_cache[image_key] = response_data
+
         return jsonify(response_data)
         
     except Exception as e:
-        logger.error(f"识别物体时发生错误: {str(e)}")
+        logger.error("识别物体时发生错误: %s", e)
         return jsonify({'error': str(e)}), 500
 
+def _cache_only_success(rv):
+    """只缓存成功响应：错误带状态码元组返回，缓存400会把识别前的查询钉死24小时"""
+    return not (isinstance(rv, tuple) and rv[1] >= 400)
+
 @app.route('/calories', methods=['GET'])
+@cache.cached(timeout=86400, query_string=True, response_filter=_cache_only_success)
 def get_calories():
     """返回已计算的卡路里值"""
     try:
         food_name = request.args.get('foodName')
         weight = request.args.get('weight')
         
-        logger.info(f"收到计算卡路里请求: 食物={food_name}, 重量={weight}")
+        logger.info("收到计算卡路里请求: 食物=%s, 重量=%s", food_name, weight)
         
         # 检查参数
         if not food_name:
@@ -313,34 +675,64 @@ def get_calories():
             return jsonify({'error': '未提供有效重量', 'calories': 0}), 400
             
         try:
-            weight = float(weight)
+            # 客户端通常传整数克重，整型路径比float往返更快
+            weight = int(weight) if weight.isdigit() else float(weight)
         except ValueError:
             return jsonify({'error': '重量格式无效', 'calories': 0}), 400
             
         if weight <= 0:
             return jsonify({'error': '重量必须大于0', 'calories': 0}), 400
             
-        # 从缓存中获取食物信息
-        food_info = food_info_cache.get(food_name)
-        if food_info:
-            # 根据新的重量调整卡路里值
-            original_weight = food_info['weight']
-            original_calories = food_info['calories']
-            adjusted_calories = int((weight / original_weight) * original_calories)
-            
-            logger.info(f"计算结果: {adjusted_calories}卡路里 (基于原始数据: {original_calories}卡路里/{original_weight}克)")
+        adjusted_calories = compute_calories(food_name, weight)
+        if adjusted_calories is not None:
             return jsonify({'calories': adjusted_calories})
-        else:
-            logger.warning(f"缓存中未找到食物信息: {food_name}")
-            return jsonify({'error': '未找到食物信息', 'calories': 0}), 400
-        
+
+        logger.warning("缓存中未找到食物信息: %s", food_name)
+        return jsonify({'error': '未找到食物信息', 'calories': 0}), 400
+
     except Exception as e:
-        logger.error(f"计算卡路里时发生错误: {str(e)}")
+        logger.error("计算卡路里时发生错误: %s", e)
         return jsonify({
             'error': str(e),
             'calories': 0
         }), 400  # 改为 400 表示客户端错误
 
+@app.route('/calories/batch', methods=['POST'])
+def get_calories_batch():
+    """批量计算多个食物的卡路里，一次请求代替N次往返"""
+    try:
+        items = request.get_json()
+        if not isinstance(items, list):
+            return jsonify({'error': '请求体必须是食物列表'}), 400
+
+        # 限制批量大小，防止恶意请求
+        items = items[:50]
+
+        results = []
+        for item in items:
+            food_name = item.get('foodName') if isinstance(item, dict) else None
+            weight = item.get('weight') if isinstance(item, dict) else None
+            try:
+                weight = float(weight)
+            except (TypeError, ValueError):
+                weight = 0
+
+            if not food_name or weight <= 0:
+                results.append({'foodName': food_name, 'calories': 0, 'error': '参数无效'})
+                continue
+
+            calories = compute_calories(food_name, weight)
+            if calories is not None:
+                results.append({'foodName': food_name, 'calories': calories})
+            else:
+                results.append({'foodName': food_name, 'calories': 0, 'error': '未找到食物信息'})
+
+        return jsonify({'results': results})
+
+    except Exception as e:
+        logger.error("批量计算卡路里时发生错误: %s", e)
+        return jsonify({'error': str(e)}), 400
+
 if __name__ == '__main__':
     port = os.getenv('PORT', 5000)
     app.run(host='0.0.0.0', port=port)
\ No newline at end of file